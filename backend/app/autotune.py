@@ -0,0 +1,253 @@
+"""
+Startup autotuning and warm-up for the caption engine.
+
+On CPU hosts the default torch thread count and cold kernels make the first
+requests several times slower than steady state. autotune() first picks the
+intra-op thread count with the lowest single-image latency (what
+/api/v1/caption runs), then the batch size with the best throughput at that
+thread count, within a time budget. It applies the result to the engine,
+warms every resident model up and persists it so later starts only need
+the warm-up.
+
+The measurements are single-stream: CaptionEngine serializes inference
+behind one lock, so under load exactly one generate() runs at a time with
+the tuned intra-op thread count, which is the configuration measured here.
+"""
+import json
+import logging
+import os
+import platform
+import time
+from typing import Any, Dict, List, Optional
+
+import torch
+from PIL import Image
+
+from .config import settings
+from .engine import CaptionEngine, prepare_image
+
+logger = logging.getLogger(__name__)
+
+# Size of the synthetic benchmark image (BLIP resizes to 384x384 anyway)
+SYNTHETIC_IMAGE_SIZE = 384
+
+
+def _synthetic_images(count: int) -> List[Image.Image]:
+    noise = prepare_image(Image.effect_noise((SYNTHETIC_IMAGE_SIZE, SYNTHETIC_IMAGE_SIZE), 64))
+    return [noise] * count
+
+
+def usable_cores() -> int:
+    """Cores this process may run on (respects CPU affinity/cpusets, unlike os.cpu_count())"""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0)) or 1
+    return os.cpu_count() or 1
+
+
+def _thread_candidates() -> List[int]:
+    """Powers of two up to the usable core count, plus the core count itself"""
+    cores = usable_cores()
+    candidates = {cores}
+    threads = 1
+    while threads < cores:
+        candidates.add(threads)
+        threads *= 2
+    return sorted(candidates)
+
+
+def host_signature(engine: CaptionEngine) -> Dict[str, Any]:
+    """Identifies the host/config a persisted tuning result is valid for"""
+    return {
+        "cpu_count": usable_cores(),
+        "machine": platform.machine(),
+        "torch": torch.__version__,
+        "device": str(engine.device),
+        "mode": engine.mode
+    }
+
+
+def _load_persisted(engine: CaptionEngine, path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning(f"Ignoring unreadable autotune file {path}: {e}")
+        return None
+    if not isinstance(data, dict):
+        logger.warning(f"Ignoring malformed autotune file {path}")
+        return None
+    if data.get("host") != host_signature(engine):
+        logger.info("Persisted autotune result is for a different host/config, re-tuning")
+        return None
+    # threads is None on GPU, where only the batch size is tuned
+    threads, batch_size = data.get("threads"), data.get("batch_size")
+    if "threads" not in data or not (threads is None or (isinstance(threads, int) and threads > 0)) or not (
+        isinstance(batch_size, int) and batch_size > 0
+    ):
+        logger.warning(f"Ignoring malformed autotune file {path}")
+        return None
+    return data
+
+
+def _use_persisted(engine: CaptionEngine, persisted: Dict[str, Any], path: str) -> Dict[str, Any]:
+    logger.info(f"Using persisted autotune result from {path}")
+    _apply(engine, persisted["threads"], persisted["batch_size"])
+    persisted["warm_up_seconds"] = warm_up(engine)
+    persisted["source"] = "persisted"
+    engine.tuning = persisted
+    return persisted
+
+
+def _persist(path: str, tuning: Dict[str, Any]):
+    try:
+        with open(path, "w") as f:
+            json.dump(tuning, f, indent=2)
+        logger.info(f"Autotune result saved to {path}")
+    except Exception as e:
+        logger.warning(f"Could not save autotune result to {path}: {e}")
+
+
+def _apply(engine: CaptionEngine, threads: Optional[int], batch_size: int):
+    if threads:
+        torch.set_num_threads(threads)
+    engine.batch_size = batch_size
+
+
+def warm_up(engine: CaptionEngine) -> Dict[str, float]:
+    """Run one synthetic image through every resident model; returns seconds per model"""
+    images = _synthetic_images(1)
+    timings = {}
+    with engine.inference_lock:
+        for key in engine.models:
+            start = time.perf_counter()
+            engine._generate_batch(images, key)
+            timings[key] = time.perf_counter() - start
+    return timings
+
+
+def _benchmark(engine: CaptionEngine, key: str, batch_size: int, repeats: int) -> float:
+    """Best-of-N seconds for one batch (the first, cold run is discarded)"""
+    images = _synthetic_images(batch_size)
+    with engine.inference_lock:
+        engine._generate_batch(images, key)
+        best = float("inf")
+        for _ in range(repeats):
+            start = time.perf_counter()
+            engine._generate_batch(images, key)
+            best = min(best, time.perf_counter() - start)
+    return best
+
+
+def autotune(engine: CaptionEngine, persist: Optional[bool] = None) -> Dict[str, Any]:
+    """
+    Pick the intra-op thread count and batch size for this host, apply them
+    to the engine, and warm up every model.
+
+    The result (also stored on engine.tuning) contains the chosen config and
+    the measured curve. Thread tuning only runs on CPU; on GPU only the batch
+    size is tuned. Measurement stops once settings.autotune_time_budget is
+    spent, keeping the best result so far. The result assumes serialized
+    inference (one generate() at a time), which the engine enforces.
+    """
+    if not engine.loaded:
+        raise RuntimeError("Model not loaded")
+
+    persist = settings.autotune_persist if persist is None else persist
+    path = settings.autotune_path
+    on_cpu = engine.device.type == "cpu"
+
+    if persist:
+        persisted = _load_persisted(engine, path)
+        if persisted:
+            return _use_persisted(engine, persisted, path)
+
+    # Tune on the model that serves most traffic
+    key = "base" if "base" in engine.models else "large"
+    thread_options = _thread_candidates() if on_cpu else [None]
+    batch_options = sorted(set(settings.autotune_batch_sizes) - {1})
+
+    logger.info(f"Autotuning {key} model: threads={thread_options}, batch sizes={[1] + batch_options}")
+    start = time.perf_counter()
+    deadline = start + settings.autotune_time_budget
+    curve = []
+    budget_exhausted = False
+
+    def measure(threads, batch_size):
+        if threads:
+            torch.set_num_threads(threads)
+        seconds = _benchmark(engine, key, batch_size, settings.autotune_repeats)
+        point = {
+            "threads": threads,
+            "batch_size": batch_size,
+            "seconds_per_batch": seconds,
+            "images_per_second": batch_size / seconds
+        }
+        curve.append(point)
+        logger.info(f"  threads={threads} batch={batch_size}: {batch_size / seconds:.2f} img/s")
+        return point
+
+    # 1. Thread count with the lowest single-image latency, most threads first
+    #    so the likely winner is measured even if the budget runs out
+    for threads in reversed(thread_options):
+        if curve and time.perf_counter() > deadline:
+            budget_exhausted = True
+            break
+        measure(threads, 1)
+    best_single = min(curve, key=lambda point: point["seconds_per_batch"])
+    threads = best_single["threads"]
+
+    # 2. Batch size with the best throughput at that thread count;
+    #    batches much larger than the thread count are not worth measuring
+    best_batch = best_single
+    for batch_size in batch_options:
+        if threads and batch_size > 4 * threads:
+            continue
+        if time.perf_counter() > deadline:
+            budget_exhausted = True
+            break
+        point = measure(threads, batch_size)
+        if point["images_per_second"] > best_batch["images_per_second"]:
+            best_batch = point
+
+    _apply(engine, threads, best_batch["batch_size"])
+
+    tuning = {
+        "host": host_signature(engine),
+        "model": key,
+        "threads": threads,
+        "interop_threads": torch.get_num_interop_threads(),
+        "batch_size": best_batch["batch_size"],
+        "single_image_seconds": best_single["seconds_per_batch"],
+        "images_per_second": best_batch["images_per_second"],
+        "curve": curve,
+        "budget_exhausted": budget_exhausted,
+        "tuning_seconds": time.perf_counter() - start
+    }
+    if persist:
+        _persist(path, tuning)
+
+    tuning["warm_up_seconds"] = warm_up(engine)
+    tuning["source"] = "measured"
+    engine.tuning = tuning
+    logger.info(f"Autotune picked threads={threads}, batch_size={best_batch['batch_size']}")
+    return tuning
+
+
+def startup_tune(engine: CaptionEngine) -> Dict[str, Any]:
+    """
+    Startup step: autotune (or reuse a matching persisted result) when
+    autotune_on_startup is set; otherwise still apply a matching persisted
+    result, and at minimum warm the models up.
+    """
+    if settings.autotune_on_startup:
+        return autotune(engine)
+
+    if settings.autotune_persist:
+        persisted = _load_persisted(engine, settings.autotune_path)
+        if persisted:
+            return _use_persisted(engine, persisted, settings.autotune_path)
+
+    engine.tuning = {"source": "warm-up only", "warm_up_seconds": warm_up(engine)}
+    return engine.tuning
@@ -8,10 +8,29 @@ class Settings(BaseSettings):
     api_prefix: str = "/api/v1"
     
     # Model Settings
-    model_name: str = "Salesforce/blip-image-captioning-large"
+    base_model_name: str = "Salesforce/blip-image-captioning-base"
+    large_model_name: str = "Salesforce/blip-image-captioning-large"
+    caption_mode: str = "base"  # "base", "large" or "cascade"
+    cascade_threshold: float = 0.5  # escalate to the large model below this confidence
     device: str = "cuda"  # or "cpu"
     max_length: int = 50
     min_length: int = 10
+    batch_size: int = 8  # images per generate() call
+    max_image_size: int = 1024  # longest side after preprocessing
+    interop_threads: Optional[int] = None  # torch inter-op threads, None = torch default
+    
+    # Startup Autotune Settings
+    autotune_on_startup: bool = True  # benchmark threads/batch size once; otherwise warm-up only
+    autotune_batch_sizes: list = [1, 2, 4, 8]
+    autotune_repeats: int = 2  # timed runs per combination (best is kept)
+    autotune_time_budget: float = 60.0  # seconds; measuring stops once spent
+    autotune_persist: bool = True  # reuse the result on the next start if the host matches
+    autotune_path: str = "autotune.json"
+    
+    # Animated GIF/WebP Settings
+    max_keyframes: int = 4  # frames captioned per animation
+    keyframe_diff_threshold: float = 12.0  # mean pixel difference (0-255) for a new keyframe
+    max_animation_frames: int = 500  # frames scanned before sampling stops
     
     # OpenAI Settings (for tone adaptation)
     openai_api_key: Optional[str] = None
@@ -28,6 +47,13 @@ class Settings(BaseSettings):
     max_file_size: int = 10 * 1024 * 1024  # 10MB
     allowed_extensions: set = {".jpg", ".jpeg", ".png", ".gif", ".bmp", ".webp"}
     
+    # Remote URL Fetch Settings
+    url_fetch_concurrency: int = 8  # simultaneous downloads
+    url_max_connections: int = 20  # pooled connections in the shared client
+    url_fetch_timeout: float = 10.0  # seconds
+    url_cache_max_bytes: int = 64 * 1024 * 1024  # ETag-revalidated bytes kept in memory
+    url_allowed_hosts: list = []  # e.g. ["cdn.example.com"]; subdomains match, empty = any public host
+    
     class Config:
         env_file = ".env"
 
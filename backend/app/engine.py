@@ -0,0 +1,603 @@
+"""
+Shared caption engine.
+
+Owns model loading, image preprocessing, batching, caching and decoding
+profiles. The API (main_full.py), CaptionGenerator and any CLI/worker call
+into the same CaptionEngine so that every optimization lands in one place.
+
+Programmatic use:
+    engine = CaptionEngine()
+    engine.load()
+    results = engine.caption(images, tones=["casual", "formal"], context=None)
+"""
+import hashlib
+import io
+import json
+import logging
+import random
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Union
+
+import torch
+from PIL import Image, ImageChops, ImageSequence, ImageStat
+from transformers import BlipForConditionalGeneration, BlipProcessor
+
+from .config import settings
+
+try:
+    import redis
+except ImportError:  # Redis is optional - the engine works without a cache
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+# Decoding profiles
+# "fast"    - base model, 3 beams (what the API has always served)
+# "quality" - large model, 4 beams
+DECODING_PROFILES = {
+    "fast": {"model": "base", "num_beams": 3},
+    "quality": {"model": "large", "num_beams": 4},
+}
+
+# Common BLIP prefix produced by the training data
+BLIP_ARTIFACT_PREFIX = "arafed "
+
+# Side of the greyscale thumbnail used for cheap frame differencing
+FRAME_DIFF_SIZE = 32
+
+
+def prepare_image(image: Image.Image, max_size: Optional[int] = None) -> Image.Image:
+    """Convert an image to RGB and downscale it for memory efficiency"""
+    max_size = max_size or settings.max_image_size
+
+    # Convert to RGB (BLIP requires RGB)
+    if image.mode != 'RGB':
+        if image.mode == 'RGBA':
+            # Create white background for transparent images
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            background.paste(image, mask=image.split()[3] if len(image.split()) > 3 else None)
+            image = background
+        else:
+            image = image.convert('RGB')
+
+    # Resize if image is too large
+    if max(image.size) > max_size:
+        ratio = max_size / max(image.size)
+        new_size = tuple(int(dim * ratio) for dim in image.size)
+        image = image.resize(new_size, Image.Resampling.LANCZOS)
+
+    return image
+
+
+def load_image(data: bytes) -> Image.Image:
+    """Decode raw image bytes into a prepared RGB image"""
+    return prepare_image(Image.open(io.BytesIO(data)))
+
+
+def _frame_signature(frame: Image.Image) -> Image.Image:
+    return frame.convert("L").resize((FRAME_DIFF_SIZE, FRAME_DIFF_SIZE), Image.Resampling.BILINEAR)
+
+
+def sample_keyframes(
+    image: Image.Image,
+    max_keyframes: Optional[int] = None,
+    diff_threshold: Optional[float] = None,
+    max_frames: Optional[int] = None
+) -> List[Image.Image]:
+    """
+    Pick a few representative, prepared frames from a (possibly animated) image.
+
+    Frames are decoded one at a time. A frame is only kept when its small
+    greyscale thumbnail differs enough from the last kept one, and the kept
+    list is halved (with the sampling stride doubled) whenever it reaches
+    twice max_keyframes, so memory stays bounded however long the animation is.
+    """
+    max_keyframes = max_keyframes or settings.max_keyframes
+    diff_threshold = settings.keyframe_diff_threshold if diff_threshold is None else diff_threshold
+    max_frames = max_frames or settings.max_animation_frames
+
+    if not getattr(image, "is_animated", False) or max_keyframes <= 1:
+        return [prepare_image(image)]
+
+    kept: List[Image.Image] = []
+    last_signature = None
+    stride = 1
+    for index, frame in enumerate(ImageSequence.Iterator(image)):
+        if index >= max_frames:
+            break
+        if index % stride:
+            continue
+
+        signature = _frame_signature(frame)
+        if last_signature is not None:
+            difference = ImageStat.Stat(ImageChops.difference(signature, last_signature)).mean[0]
+            if difference < diff_threshold:
+                continue
+        last_signature = signature
+
+        # convert() copies the frame, so it survives the iterator seeking on
+        kept.append(prepare_image(frame.convert("RGBA")))
+        if len(kept) >= 2 * max_keyframes:
+            kept = kept[::2]
+            stride *= 2
+
+    # Spread the final selection evenly over what was kept
+    if len(kept) > max_keyframes:
+        last = len(kept) - 1
+        kept = [kept[round(i * last / (max_keyframes - 1))] for i in range(max_keyframes)]
+    return kept
+
+
+def load_keyframes(data: bytes) -> List[Image.Image]:
+    """Decode raw image bytes into prepared keyframes (one frame for still images)"""
+    return sample_keyframes(Image.open(io.BytesIO(data)))
+
+
+def merge_frame_captions(captions: Sequence[str]) -> str:
+    """
+    Combine per-keyframe captions, in temporal order, into a single caption.
+    Only consecutive repeats are collapsed, so a return (cat, dog, cat) is kept.
+    """
+    merged = []
+    for caption in captions:
+        if caption and (not merged or merged[-1] != caption):
+            merged.append(caption)
+    return ", then ".join(merged)
+
+
+def adapt_caption_to_tone(caption: str, tone: str) -> str:
+    """
+    Adapt the AI-generated caption to match the requested tone.
+    This preserves the actual content while changing the style.
+    """
+
+    # Clean up the base caption
+    caption = caption.strip()
+
+    # Remove common BLIP prefixes
+    prefixes_to_remove = [
+        "a photo of", "an image of", "a picture of",
+        "there is", "there are", "this is"
+    ]
+
+    caption_lower = caption.lower()
+    for prefix in prefixes_to_remove:
+        if caption_lower.startswith(prefix):
+            caption = caption[len(prefix):].strip()
+            break
+
+    # Ensure caption starts with lowercase for integration
+    if caption and caption[0].isupper() and len(caption) > 1:
+        caption = caption[0].lower() + caption[1:]
+
+    # Apply tone-specific formatting
+    if tone == "formal":
+        # Professional and descriptive
+        return f"The image depicts {caption}, presenting a detailed view of the subject matter."
+
+    elif tone == "casual":
+        # Friendly and conversational
+        if not caption.endswith(("!", ".", "?")):
+            caption += "!"
+        return f"Check out this {caption}"
+
+    elif tone == "humorous":
+        # Witty and entertaining
+        funny_intros = [
+            f"Plot twist: it's {caption} 😄",
+            f"Surprise! We've got {caption} here! 🎉",
+            f"Breaking: Local image contains {caption}! 📰",
+            f"Nobody expects {caption}! 😂"
+        ]
+        return random.choice(funny_intros)
+
+    elif tone == "poetic":
+        # Lyrical and evocative
+        return f"In this captured moment, {caption} emerges like a whispered dream, painting stories in light and shadow..."
+
+    elif tone == "technical":
+        # Precise and analytical
+        return f"Technical Analysis: The image composition features {caption}. Observable elements include structured arrangement and balanced visual hierarchy."
+
+    elif tone == "marketing":
+        # Engaging and persuasive
+        return f"✨ Discover the beauty of {caption} - Capturing moments that inspire and elevate your vision! #Trending"
+
+    elif tone == "storytelling":
+        # Narrative and engaging
+        return f"Once upon a time, in a world frozen in pixels, there was {caption}. And what a tale it tells..."
+
+    else:
+        # Default - return with slight enhancement
+        return f"This image shows {caption}."
+
+
+class CaptionEngine:
+    def __init__(
+        self,
+        mode: Optional[str] = None,
+        threshold: Optional[float] = None,
+        use_cache: bool = True
+    ):
+        self.mode = mode or settings.caption_mode
+        self.threshold = settings.cascade_threshold if threshold is None else threshold
+        self.batch_size = settings.batch_size
+        self.device = None
+        self.loaded = False
+        # Resident models: {"base": (processor, model), "large": (processor, model)}
+        self.models = {}
+        self.use_cache = use_cache
+        self.redis_client = None
+        # Chosen thread/batch config and measured curve, set by autotune.autotune()
+        self.tuning = None
+        # One generate() at a time: the models and stats are shared, and each call
+        # already uses all the intra-op threads autotune picked
+        self.inference_lock = threading.Lock()
+        self.stats = {
+            "requests": 0,
+            "escalated": 0,
+            "escalated_low_confidence": 0,
+            "escalated_quality_requested": 0,
+            "cache_hits": 0
+        }
+
+    # ------------------------------------------------------------------
+    # Loading
+    # ------------------------------------------------------------------
+
+    def model_names(self) -> Dict[str, str]:
+        """Models required by the configured mode"""
+        if self.mode == "cascade":
+            return {"base": settings.base_model_name, "large": settings.large_model_name}
+        if self.mode == "large":
+            return {"large": settings.large_model_name}
+        return {"base": settings.base_model_name}
+
+    def load(self) -> bool:
+        """Load the BLIP model(s) and connect the cache"""
+        try:
+            self.device = torch.device(settings.device if torch.cuda.is_available() else "cpu")
+            logger.info(f"Using device: {self.device}, caption mode: {self.mode}")
+
+            if settings.interop_threads:
+                try:
+                    # Only allowed before torch starts any inter-op parallel work
+                    torch.set_num_interop_threads(settings.interop_threads)
+                except RuntimeError as e:
+                    logger.warning(f"Could not set inter-op threads: {e}")
+
+            models = {}
+            for key, model_name in self.model_names().items():
+                logger.info(f"Loading model: {model_name}")
+                processor = BlipProcessor.from_pretrained(model_name)
+                model = BlipForConditionalGeneration.from_pretrained(
+                    model_name,
+                    torch_dtype=torch.float32
+                )
+                model.to(self.device)
+                model.eval()
+                models[key] = (processor, model)
+
+            self.models = models
+            self.loaded = True
+            logger.info("Model loaded successfully")
+        except Exception as e:
+            logger.error(f"Error loading model: {e}")
+            self.loaded = False
+            return False
+
+        if self.use_cache:
+            self._initialize_cache()
+        return True
+
+    def _initialize_cache(self):
+        """Initialize Redis cache for storing generated base captions"""
+        if redis is None:
+            logger.warning("redis package not installed. Continuing without cache.")
+            return
+        try:
+            self.redis_client = redis.from_url(settings.redis_url)
+            self.redis_client.ping()
+            logger.info("Redis cache initialized")
+        except Exception as e:
+            logger.warning(f"Redis not available: {e}. Continuing without cache.")
+            self.redis_client = None
+
+    # ------------------------------------------------------------------
+    # Caching
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def image_hash(image: Image.Image) -> str:
+        """Generate a hash for the image for caching purposes"""
+        return hashlib.md5(image.tobytes()).hexdigest()
+
+    def _cache_key(self, image_hash: str, quality: str, context: Optional[str]) -> str:
+        # Results depend on which checkpoints are resident and, when escalating
+        # on confidence, on the threshold - a change to either must miss the cache
+        models = ",".join(f"{key}={name}" for key, name in sorted(self.model_names().items()))
+        key = f"caption:{image_hash}:{self.mode}:{hashlib.md5(models.encode('utf-8')).hexdigest()[:12]}:{quality}"
+        if quality == "auto" and self.mode == "cascade":
+            key += f":t{self.threshold}"
+        if context:
+            key += ":" + hashlib.md5(context.encode("utf-8")).hexdigest()
+        return key
+
+    def _get_cached(self, key: str) -> Optional[Dict[str, Any]]:
+        if not self.redis_client:
+            return None
+        try:
+            cached = self.redis_client.get(key)
+            if cached:
+                return json.loads(cached)
+        except Exception as e:
+            logger.warning(f"Cache retrieval error: {e}")
+        return None
+
+    def _set_cached(self, key: str, result: Dict[str, Any]):
+        if not self.redis_client:
+            return
+        try:
+            self.redis_client.setex(key, settings.cache_ttl, json.dumps(result))
+        except Exception as e:
+            logger.warning(f"Cache storage error: {e}")
+
+    # ------------------------------------------------------------------
+    # Inference
+    # ------------------------------------------------------------------
+
+    def _profile_for(self, key: str) -> Dict[str, Any]:
+        return DECODING_PROFILES["fast" if key == "base" else "quality"]
+
+    def _generate_batch(
+        self,
+        images: List[Image.Image],
+        key: str,
+        context: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """Run one model over a batch of images and return caption + confidence for each"""
+        processor, model = self.models[key]
+        profile = self._profile_for(key)
+
+        if context:
+            prompts = [f"{context}. "] * len(images)
+            inputs = processor(images=images, text=prompts, return_tensors="pt", padding=True)
+        else:
+            inputs = processor(images=images, return_tensors="pt")
+        inputs = inputs.to(self.device)
+
+        with torch.no_grad():
+            output = model.generate(
+                **inputs,
+                max_length=settings.max_length,
+                min_length=settings.min_length,
+                num_beams=profile["num_beams"],
+                do_sample=False,  # Deterministic for consistency
+                early_stopping=True,
+                output_scores=True,
+                return_dict_in_generate=True
+            )
+
+        captions = processor.batch_decode(output.sequences, skip_special_tokens=True)
+        # Beam score is the length-normalized log-probability of each sequence
+        scores = getattr(output, "sequences_scores", None)
+
+        results = []
+        for i, caption in enumerate(captions):
+            caption = caption.strip()
+            if caption.startswith(BLIP_ARTIFACT_PREFIX):
+                caption = caption[len(BLIP_ARTIFACT_PREFIX):]
+            confidence = float(torch.exp(scores[i]).item()) if scores is not None else 0.0
+            results.append({"caption": caption, "confidence": confidence, "model": key, "escalated": False})
+        return results
+
+    def _generate(
+        self,
+        images: List[Image.Image],
+        key: str,
+        context: Optional[str] = None,
+        batch_size: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """Run one model over any number of images in batches of batch_size"""
+        batch_size = batch_size or self.batch_size
+        results = []
+        for start in range(0, len(images), batch_size):
+            results.extend(self._generate_batch(images[start:start + batch_size], key, context))
+        return results
+
+    def _generate_cascaded(
+        self,
+        images: List[Image.Image],
+        quality: str,
+        context: Optional[str],
+        batch_size: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Base model first, escalating to the large model when needed.
+        quality: "fast" (never escalate), "auto" (escalate below threshold)
+        or "quality" (always use the large model).
+        """
+        if "large" not in self.models:
+            return self._generate(images, "base", context, batch_size)
+        if "base" not in self.models:
+            return self._generate(images, "large", context, batch_size)
+
+        if quality == "quality":
+            self.stats["escalated"] += len(images)
+            self.stats["escalated_quality_requested"] += len(images)
+            results = self._generate(images, "large", context, batch_size)
+            for result in results:
+                result["escalated"] = True
+            return results
+
+        results = self._generate(images, "base", context, batch_size)
+        if quality == "fast":
+            return results
+
+        # Re-run only the low-confidence images through the large model, as one batch
+        low = [i for i, result in enumerate(results) if result["confidence"] < self.threshold]
+        if low:
+            logger.info(f"Escalating {len(low)}/{len(images)} image(s) to large model")
+            self.stats["escalated"] += len(low)
+            self.stats["escalated_low_confidence"] += len(low)
+            escalated = self._generate([images[i] for i in low], "large", context, batch_size)
+            for i, result in zip(low, escalated):
+                result["escalated"] = True
+                results[i] = result
+        return results
+
+    def caption(
+        self,
+        images: Union[Image.Image, Sequence[Image.Image]],
+        tones: Union[str, Sequence[str]] = ("casual",),
+        context: Optional[str] = None,
+        quality: str = "auto",
+        batch_size: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Caption one or more prepared images.
+
+        Returns one dict per image with the base caption, its confidence,
+        the model that produced it and a {tone: caption} mapping for every
+        requested tone. batch_size overrides the engine's (autotuned) batch size.
+        """
+        if not self.loaded:
+            raise RuntimeError("Model not loaded")
+
+        if isinstance(images, Image.Image):
+            images = [images]
+        if isinstance(tones, str):
+            tones = [tones]
+        images = list(images)
+
+        with self.inference_lock:
+            return self._caption_locked(images, tones, context, quality, batch_size)
+
+    def _caption_locked(
+        self,
+        images: List[Image.Image],
+        tones: Sequence[str],
+        context: Optional[str],
+        quality: str,
+        batch_size: Optional[int]
+    ) -> List[Dict[str, Any]]:
+        start_time = time.time()
+        self.stats["requests"] += len(images)
+
+        # Serve what we can from the cache; only the misses go to the model.
+        # Hashing full images is not free, so skip it when there is no cache.
+        results: List[Optional[Dict[str, Any]]] = [None] * len(images)
+        keys: List[Optional[str]] = [None] * len(images)
+        misses = []
+        for i, image in enumerate(images):
+            if self.redis_client:
+                keys[i] = self._cache_key(self.image_hash(image), quality, context)
+                cached = self._get_cached(keys[i])
+                if cached:
+                    self.stats["cache_hits"] += 1
+                    results[i] = cached
+                    continue
+            misses.append(i)
+
+        if misses:
+            generated = self._generate_cascaded([images[i] for i in misses], quality, context, batch_size)
+            for i, result in zip(misses, generated):
+                if keys[i]:
+                    self._set_cached(keys[i], result)
+                results[i] = result
+
+        processing_time = time.time() - start_time
+        return [
+            {
+                **result,
+                "context": context,
+                "captions": {tone: adapt_caption_to_tone(result["caption"], tone) for tone in tones},
+                "processing_time": processing_time
+            }
+            for result in results
+        ]
+
+    def caption_frames(
+        self,
+        frames: Sequence[Image.Image],
+        tones: Union[str, Sequence[str]] = ("casual",),
+        context: Optional[str] = None,
+        quality: str = "auto"
+    ) -> Dict[str, Any]:
+        """
+        Caption the keyframes of one image in a single batched call and
+        merge them into one result (same shape as an item from caption()).
+        """
+        if isinstance(tones, str):
+            tones = [tones]
+        frames = list(frames)
+
+        # All keyframes go through each model as one batch whatever the tuned
+        # batch size is; max_keyframes already bounds its size
+        results = self.caption(
+            frames,
+            tones=[] if len(frames) > 1 else tones,
+            context=context,
+            quality=quality,
+            batch_size=len(frames)
+        )
+        if len(results) == 1:
+            return {**results[0], "frames": 1}
+
+        caption = merge_frame_captions([result["caption"] for result in results])
+        return {
+            "caption": caption,
+            "confidence": sum(result["confidence"] for result in results) / len(results),
+            "model": "large" if any(result["model"] == "large" for result in results) else "base",
+            "escalated": any(result["escalated"] for result in results),
+            "context": context,
+            "captions": {tone: adapt_caption_to_tone(caption, tone) for tone in tones},
+            "processing_time": results[0]["processing_time"],
+            "frames": len(results)
+        }
+
+    def engine_stats(self) -> Dict[str, Any]:
+        """Escalation and cache counters for the status endpoint"""
+        requests = self.stats["requests"]
+        return {
+            **self.stats,
+            "escalation_rate": self.stats["escalated"] / requests if requests else 0.0
+        }
+
+
+_engine: Optional[CaptionEngine] = None
+
+
+def get_engine() -> CaptionEngine:
+    """Process-wide engine shared by the API, CaptionGenerator and workers"""
+    global _engine
+    if _engine is None:
+        _engine = CaptionEngine()
+    return _engine
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description="Caption local images with the shared engine")
+    parser.add_argument("images", nargs="+", help="Image files to caption")
+    parser.add_argument("--tone", action="append", dest="tones", help="Tone(s) to apply (repeatable)")
+    parser.add_argument("--context", default=None, help="Optional contextual prompt")
+    parser.add_argument("--quality", default="auto", choices=["fast", "auto", "quality"])
+    parser.add_argument("--mode", default=None, choices=["base", "large", "cascade"])
+    args = parser.parse_args()
+
+    engine = CaptionEngine(mode=args.mode)
+    if not engine.load():
+        raise SystemExit("Failed to load model")
+
+    for path in args.images:
+        with open(path, "rb") as f:
+            frames = load_keyframes(f.read())
+        result = engine.caption_frames(frames, args.tones or ["casual"], args.context, args.quality)
+        print(f"{path}: [{result['model']} {result['confidence']:.2f}, {result['frames']} frame(s)] {result['caption']}")
+        for tone, text in result["captions"].items():
+            print(f"  {tone}: {text}")
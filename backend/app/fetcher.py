@@ -0,0 +1,286 @@
+"""
+Remote image ingestion.
+
+A single pooled httpx.AsyncClient is shared by every request, concurrent
+downloads are capped by a semaphore, bodies are streamed with the
+max_file_size limit enforced as bytes arrive, and fetched bytes are kept in
+a small LRU cache that is revalidated with ETag/Last-Modified conditional
+GETs.
+
+Only public addresses are fetched (optionally restricted further by
+url_allowed_hosts). The address check happens inside the connection
+itself: GuardedNetworkBackend resolves the host once, validates every
+address and dials the validated IP, while TLS SNI and the Host header keep
+the original hostname. A resolver that changes its answer between a check
+and the connect (DNS rebinding) therefore cannot redirect the request.
+Redirects are followed by hand, so every hop goes through the same guard.
+"""
+import asyncio
+import ipaddress
+import logging
+import socket
+from collections import OrderedDict
+from typing import Awaitable, Callable, Iterable, List, Optional, Sequence, Union
+from urllib.parse import urlparse
+
+import httpcore
+import httpx
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+# Redirect hops followed before giving up
+MAX_REDIRECTS = 5
+
+
+class ImageFetchError(Exception):
+    """Raised when a remote image cannot be fetched; carries an HTTP status for the API"""
+
+    def __init__(self, status_code: int, message: str):
+        super().__init__(message)
+        self.status_code = status_code
+        self.message = message
+
+
+def is_public_address(address: str) -> bool:
+    return ipaddress.ip_address(address.split("%")[0]).is_global
+
+
+async def resolve_host(host: str, port: int) -> List[str]:
+    """Resolve a hostname to its IP addresses with the running loop's resolver"""
+    infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    return [info[4][0] for info in infos]
+
+
+class GuardedNetworkBackend(httpcore.AsyncNetworkBackend):
+    """
+    httpcore network backend that only dials validated addresses.
+
+    The host is resolved exactly once per connection and the socket is opened
+    to the address that passed the check, so there is no window for DNS
+    rebinding between validation and connect.
+    """
+
+    def __init__(
+        self,
+        resolver: Callable[[str, int], Awaitable[List[str]]] = resolve_host,
+        address_allowed: Callable[[str], bool] = is_public_address
+    ):
+        self._backend = httpcore.AnyIOBackend()
+        self._resolver = resolver
+        self._address_allowed = address_allowed
+
+    async def connect_tcp(
+        self,
+        host: str,
+        port: int,
+        timeout: Optional[float] = None,
+        local_address: Optional[str] = None,
+        socket_options: Optional[Iterable] = None
+    ) -> httpcore.AsyncNetworkStream:
+        try:
+            ipaddress.ip_address(host.split("%")[0])
+            addresses = [host]
+        except ValueError:
+            try:
+                addresses = await self._resolver(host, port)
+            except (socket.gaierror, UnicodeError, ValueError):
+                raise ImageFetchError(400, f"Could not resolve host: {host}")
+
+        if not addresses or not all(self._address_allowed(address) for address in addresses):
+            raise ImageFetchError(400, f"Host not allowed: {host}")
+
+        return await self._backend.connect_tcp(
+            addresses[0],
+            port,
+            timeout=timeout,
+            local_address=local_address,
+            socket_options=socket_options
+        )
+
+    async def connect_unix_socket(self, path, timeout=None, socket_options=None):
+        raise ImageFetchError(400, "Unix sockets are not allowed")
+
+    async def sleep(self, seconds: float) -> None:
+        await self._backend.sleep(seconds)
+
+
+class GuardedTransport(httpx.AsyncHTTPTransport):
+    """AsyncHTTPTransport whose connection pool dials through GuardedNetworkBackend"""
+
+    def __init__(self, network_backend: GuardedNetworkBackend, limits: httpx.Limits):
+        super().__init__(limits=limits)
+        # httpx has no public hook for the network backend, so replace the pool it built
+        self._pool = httpcore.AsyncConnectionPool(
+            ssl_context=httpx.create_ssl_context(),
+            max_connections=limits.max_connections,
+            max_keepalive_connections=limits.max_keepalive_connections,
+            keepalive_expiry=limits.keepalive_expiry,
+            network_backend=network_backend
+        )
+
+
+class ImageFetcher:
+    def __init__(
+        self,
+        client: Optional[httpx.AsyncClient] = None,
+        concurrency: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        cache_max_bytes: Optional[int] = None,
+        allowed_hosts: Optional[Sequence[str]] = None,
+        allow_private_networks: bool = False,
+        resolver: Optional[Callable[[str, int], Awaitable[List[str]]]] = None
+    ):
+        # A client passed in is used as-is (no address guard) and is not closed by us
+        self._client = client
+        self._owns_client = client is None
+        self.semaphore = asyncio.Semaphore(concurrency or settings.url_fetch_concurrency)
+        self.max_bytes = max_bytes or settings.max_file_size
+        self.cache_max_bytes = settings.url_cache_max_bytes if cache_max_bytes is None else cache_max_bytes
+        self.allowed_hosts = [host.lower() for host in (settings.url_allowed_hosts if allowed_hosts is None else allowed_hosts)]
+        # Loopback/RFC1918/link-local targets are refused unless explicitly allowed (e.g. local tests)
+        self.network_backend = GuardedNetworkBackend(
+            resolver=resolver or resolve_host,
+            address_allowed=(lambda address: True) if allow_private_networks else is_public_address
+        )
+        # url -> {"etag", "last_modified", "content"}, least recently used first
+        self._cache: "OrderedDict[str, dict]" = OrderedDict()
+        self._cache_size = 0
+        self.stats = {"fetched": 0, "not_modified": 0, "cache_evictions": 0}
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            limits = httpx.Limits(
+                max_connections=settings.url_max_connections,
+                max_keepalive_connections=settings.url_max_connections
+            )
+            self._client = httpx.AsyncClient(
+                transport=GuardedTransport(self.network_backend, limits),
+                timeout=settings.url_fetch_timeout,
+                follow_redirects=False,  # followed by hand so each hop is validated
+                trust_env=False  # an environment proxy would bypass the address guard
+            )
+        return self._client
+
+    async def close(self):
+        if self._client is not None and self._owns_client:
+            await self._client.aclose()
+            self._client = None
+
+    # ------------------------------------------------------------------
+    # Cache
+    # ------------------------------------------------------------------
+
+    def _cache_get(self, url: str) -> Optional[dict]:
+        entry = self._cache.get(url)
+        if entry is not None:
+            self._cache.move_to_end(url)
+        return entry
+
+    def _cache_put(self, url: str, content: bytes, etag: Optional[str], last_modified: Optional[str]):
+        # Only responses that can be revalidated are worth keeping
+        if not (etag or last_modified) or len(content) > self.cache_max_bytes:
+            return
+        old = self._cache.pop(url, None)
+        if old is not None:
+            self._cache_size -= len(old["content"])
+        self._cache[url] = {"etag": etag, "last_modified": last_modified, "content": content}
+        self._cache_size += len(content)
+        while self._cache_size > self.cache_max_bytes:
+            _, evicted = self._cache.popitem(last=False)
+            self._cache_size -= len(evicted["content"])
+            self.stats["cache_evictions"] += 1
+
+    # ------------------------------------------------------------------
+    # Fetching
+    # ------------------------------------------------------------------
+
+    def _check_url(self, url: str):
+        """Reject non-HTTP schemes and hosts outside url_allowed_hosts (addresses are checked at connect)"""
+        parsed = urlparse(url)
+        if parsed.scheme not in ("http", "https"):
+            raise ImageFetchError(400, f"Unsupported URL scheme: {url}")
+        host = (parsed.hostname or "").lower()
+        if not host:
+            raise ImageFetchError(400, f"Invalid URL: {url}")
+        if self.allowed_hosts and not any(
+            host == allowed or host.endswith("." + allowed) for allowed in self.allowed_hosts
+        ):
+            raise ImageFetchError(400, f"Host not allowed: {host}")
+
+    async def _download(self, url: str, headers: dict, cached: Optional[dict]):
+        """Fetch url, following validated redirects; returns (content, etag, last_modified)"""
+        for _ in range(MAX_REDIRECTS + 1):
+            self._check_url(url)
+            async with self.client.stream("GET", url, headers=headers, follow_redirects=False) as response:
+                if response.has_redirect_location:
+                    url = str(response.url.join(response.headers.get("location", "")))
+                    continue
+                if response.status_code == 304 and cached:
+                    self.stats["not_modified"] += 1
+                    return cached["content"], cached["etag"], cached["last_modified"]
+                if response.status_code != 200:
+                    # Keep upstream details out of the client response
+                    logger.warning(f"Fetching {url} returned HTTP {response.status_code}")
+                    raise ImageFetchError(400, "Remote server did not return an image")
+
+                declared = response.headers.get("content-length")
+                if declared and declared.isdigit() and int(declared) > self.max_bytes:
+                    raise ImageFetchError(413, f"Remote image exceeds {self.max_bytes} bytes")
+
+                # Stop reading as soon as the limit is crossed instead of trusting Content-Length
+                body = bytearray()
+                async for chunk in response.aiter_bytes():
+                    body.extend(chunk)
+                    if len(body) > self.max_bytes:
+                        raise ImageFetchError(413, f"Remote image exceeds {self.max_bytes} bytes")
+
+                self.stats["fetched"] += 1
+                return bytes(body), response.headers.get("etag"), response.headers.get("last-modified")
+
+        raise ImageFetchError(400, f"Too many redirects fetching {url}")
+
+    async def fetch(self, url: str) -> bytes:
+        """Download one image, honouring the size limit and the conditional-GET cache"""
+        cached = self._cache_get(url)
+        headers = {}
+        if cached:
+            if cached["etag"]:
+                headers["If-None-Match"] = cached["etag"]
+            if cached["last_modified"]:
+                headers["If-Modified-Since"] = cached["last_modified"]
+
+        async with self.semaphore:
+            try:
+                content, etag, last_modified = await self._download(url, headers, cached)
+            except ImageFetchError:
+                raise
+            except (ValueError, httpx.InvalidURL, httpx.UnsupportedProtocol) as e:
+                raise ImageFetchError(400, f"Invalid URL: {e}")
+            except httpx.HTTPError as e:
+                raise ImageFetchError(502, f"Failed to fetch {url}: {e}")
+
+        if not content:
+            raise ImageFetchError(400, f"Empty response from {url}")
+
+        self._cache_put(url, content, etag, last_modified)
+        return content
+
+    async def fetch_many(self, urls: Sequence[str]) -> List[Union[bytes, ImageFetchError]]:
+        """Fetch several images concurrently; failures are returned in place, not raised"""
+        async def fetch_one(url):
+            try:
+                return await self.fetch(url)
+            except ImageFetchError as e:
+                return e
+            except Exception as e:
+                # One bad URL must not fail the whole batch
+                logger.error(f"Unexpected error fetching {url!r}: {e}")
+                return ImageFetchError(502, "Failed to fetch remote image")
+
+        return await asyncio.gather(*(fetch_one(url) for url in urls))
+
+    def fetcher_stats(self) -> dict:
+        return {**self.stats, "cached_urls": len(self._cache), "cached_bytes": self._cache_size}
@@ -1,14 +1,16 @@
 from fastapi import FastAPI, UploadFile, File, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from PIL import Image
-import io
+from starlette.concurrency import run_in_threadpool
 from datetime import datetime
 import uuid
 import logging
 import time
-import torch
-from transformers import BlipProcessor, BlipForConditionalGeneration
-import os
+
+from .autotune import startup_tune
+from .config import settings
+from .engine import adapt_caption_to_tone, get_engine, load_keyframes
+from .fetcher import ImageFetcher, ImageFetchError
+from .models import BatchCaptionUrlRequest, CaptionUrlRequest, QualityEnum
 
 # Configure logging
 logging.basicConfig(
@@ -33,87 +35,11 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Global model variables
-class ModelManager:
-    def __init__(self):
-        self.processor = None
-        self.model = None
-        self.device = None
-        self.loaded = False
-        
-    def load(self):
-        """Load the BLIP model for real caption generation"""
-        try:
-            logger.info("🚀 Starting to load BLIP model...")
-            
-            # Set device
-            self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-            logger.info(f"📱 Using device: {self.device}")
-            
-            # Model selection - using base model for faster loading
-            model_name = "Salesforce/blip-image-captioning-base"
-            logger.info(f"📦 Loading model: {model_name}")
-            logger.info("⏳ This may take a minute on first run...")
-            
-            # Load processor
-            self.processor = BlipProcessor.from_pretrained(model_name)
-            logger.info("✅ Processor loaded")
-            
-            # Load model
-            self.model = BlipForConditionalGeneration.from_pretrained(
-                model_name,
-                torch_dtype=torch.float32
-            )
-            self.model.to(self.device)
-            self.model.eval()
-            
-            self.loaded = True
-            logger.info("🎉 Model loaded successfully!")
-            return True
-            
-        except Exception as e:
-            logger.error(f"❌ Failed to load model: {str(e)}")
-            self.loaded = False
-            return False
-    
-    def generate_caption(self, image: Image.Image, num_beams: int = 3, max_length: int = 50):
-        """Generate a caption for the given image"""
-        if not self.loaded:
-            raise Exception("Model not loaded")
-        
-        try:
-            # Prepare the image
-            inputs = self.processor(image, return_tensors="pt").to(self.device)
-            
-            # Generate caption with beam search for better quality
-            with torch.no_grad():
-                output_ids = self.model.generate(
-                    **inputs,
-                    max_length=max_length,
-                    min_length=10,
-                    num_beams=num_beams,
-                    temperature=1.0,
-                    top_p=0.9,
-                    do_sample=False,  # Deterministic for consistency
-                    early_stopping=True
-                )
-            
-            # Decode the caption
-            caption = self.processor.decode(output_ids[0], skip_special_tokens=True)
-            
-            # Clean up the caption
-            caption = caption.strip()
-            if caption.startswith("arafed "):  # Common BLIP prefix
-                caption = caption[7:]
-            
-            return caption
-            
-        except Exception as e:
-            logger.error(f"Error generating caption: {str(e)}")
-            raise
+# Initialize the shared caption engine
+model_manager = get_engine()
 
-# Initialize model manager
-model_manager = ModelManager()
+# Shared pooled HTTP client for remote image URLs
+image_fetcher = ImageFetcher()
 
 # Load model on startup
 @app.on_event("startup")
@@ -126,6 +52,13 @@ async def startup_event():
     success = model_manager.load()
     
     if success:
+        # Tune threads/batch size for this host and warm the kernels up,
+        # so the first real requests run at steady-state speed
+        try:
+            startup_tune(model_manager)
+            logger.info("🔥 Model warmed up")
+        except Exception as e:
+            logger.warning(f"⚠️ Autotune/warm-up failed: {e}")
         logger.info("✅ Ready to generate real AI captions!")
     else:
         logger.warning("⚠️ Running without model - will use fallback captions")
@@ -134,6 +67,10 @@ async def startup_event():
     logger.info("📚 Documentation at: http://localhost:8000/docs")
     logger.info("="*60)
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    await image_fetcher.close()
+
 # Root endpoint
 @app.get("/")
 async def root():
@@ -167,7 +104,8 @@ async def test():
 @app.post("/api/v1/caption")
 async def generate_caption(
     file: UploadFile = File(...),
-    tone: str = "casual"
+    tone: str = "casual",
+    quality: QualityEnum = QualityEnum.auto
 ):
     """
     Generate a real AI caption for the uploaded image.
@@ -175,7 +113,8 @@ async def generate_caption(
     """
     
     start_time = time.time()
-    logger.info(f"📸 Received request - File: {file.filename}, Tone: {tone}")
+    quality = quality.value
+    logger.info(f"📸 Received request - File: {file.filename}, Tone: {tone}, Quality: {quality}")
     
     try:
         # Read and validate image
@@ -183,70 +122,15 @@ async def generate_caption(
         if len(contents) == 0:
             raise HTTPException(400, "Empty file uploaded")
         
-        # Open and prepare image
-        try:
-            image = Image.open(io.BytesIO(contents))
-            
-            # Convert to RGB (BLIP requires RGB)
-            if image.mode != 'RGB':
-                if image.mode == 'RGBA':
-                    # Create white background for transparent images
-                    background = Image.new('RGB', image.size, (255, 255, 255))
-                    background.paste(image, mask=image.split()[3] if len(image.split()) > 3 else None)
-                    image = background
-                else:
-                    image = image.convert('RGB')
-            
-            # Resize if image is too large (for memory efficiency)
-            max_size = 1024
-            if max(image.size) > max_size:
-                ratio = max_size / max(image.size)
-                new_size = tuple(int(dim * ratio) for dim in image.size)
-                image = image.resize(new_size, Image.Resampling.LANCZOS)
-            
-            logger.info(f"📐 Image prepared: {image.size}, Mode: {image.mode}")
-            
-        except Exception as e:
-            logger.error(f"Invalid image: {e}")
-            raise HTTPException(400, f"Invalid image file: {str(e)}")
-        
-        # Generate caption
-        if model_manager.loaded:
-            try:
-                # Generate real AI caption
-                logger.info("🤖 Generating AI caption...")
-                base_caption = model_manager.generate_caption(image)
-                logger.info(f"✨ Generated caption: {base_caption}")
-                confidence = 0.85  # Real AI confidence
-                
-            except Exception as e:
-                logger.error(f"Model inference failed: {e}")
-                # Fallback to a generic caption
-                base_caption = "an interesting scene"
-                confidence = 0.3
-        else:
-            # Model not loaded - use generic fallback
-            logger.warning("Model not loaded, using fallback")
-            base_caption = "an image that requires AI analysis"
-            confidence = 0.1
-        
-        # Apply tone adaptation to the base caption
-        final_caption = adapt_caption_to_tone(base_caption, tone)
+        # Open and prepare image (RGB, downscaled for memory efficiency).
+        # Animated GIF/WebP images are reduced to a few representative keyframes.
+        # Decoding and inference are blocking; keep them off the event loop
+        frames = await run_in_threadpool(decode_frames, contents)
+        logger.info(f"📐 Image prepared: {frames[0].size}, Frames: {len(frames)}")
         
-        # Calculate processing time
-        processing_time = time.time() - start_time
+        response = await run_in_threadpool(caption_response, frames, tone, quality, start_time)
         
-        # Generate response
-        response = {
-            "caption": final_caption,
-            "tone": tone,
-            "confidence": confidence,
-            "processing_time": processing_time,
-            "timestamp": datetime.utcnow().isoformat(),
-            "image_id": str(uuid.uuid4())
-        }
-        
-        logger.info(f"✅ Request completed in {processing_time:.2f}s")
+        logger.info(f"✅ Request completed in {response['processing_time']:.2f}s")
         return response
         
     except HTTPException:
@@ -255,72 +139,144 @@ async def generate_caption(
         logger.error(f"Unexpected error: {str(e)}")
         raise HTTPException(500, f"Internal server error: {str(e)}")
 
-def adapt_caption_to_tone(caption: str, tone: str) -> str:
+def decode_frames(contents: bytes):
+    """Decode image bytes into keyframes, mapping failures to a 400"""
+    try:
+        return load_keyframes(contents)
+    except Exception as e:
+        logger.error(f"Invalid image: {e}")
+        raise HTTPException(400, f"Invalid image file: {str(e)}")
+
+def caption_response(frames, tone: str, quality: str, start_time: float, result=None):
     """
-    Adapt the AI-generated caption to match the requested tone.
-    This preserves the actual content while changing the style.
+    Caption prepared keyframes and build the API response.
+    `result` may be passed in when the engine already ran (batched requests).
     """
+    # Generate caption
+    model_used = None
+    final_caption = None
+    if model_manager.loaded:
+        try:
+            # Generate real AI caption
+            logger.info("🤖 Generating AI caption...")
+            if result is None:
+                result = model_manager.caption_frames(frames, tones=tone, quality=quality)
+            base_caption = result["caption"]
+            final_caption = result["captions"][tone]
+            confidence = result["confidence"]
+            model_used = result["model"]
+            logger.info(f"✨ Generated caption ({model_used}): {base_caption}")
+            
+        except Exception as e:
+            logger.error(f"Model inference failed: {e}")
+            # Fallback to a generic caption
+            base_caption = "an interesting scene"
+            confidence = 0.3
+    else:
+        # Model not loaded - use generic fallback
+        logger.warning("Model not loaded, using fallback")
+        base_caption = "an image that requires AI analysis"
+        confidence = 0.1
     
-    # Clean up the base caption
-    caption = caption.strip()
+    # Apply tone adaptation to the fallback caption
+    if final_caption is None:
+        final_caption = adapt_caption_to_tone(base_caption, tone)
     
-    # Remove common BLIP prefixes
-    prefixes_to_remove = [
-        "a photo of", "an image of", "a picture of",
-        "there is", "there are", "this is"
-    ]
+    # Calculate processing time
+    processing_time = time.time() - start_time
     
-    caption_lower = caption.lower()
-    for prefix in prefixes_to_remove:
-        if caption_lower.startswith(prefix):
-            caption = caption[len(prefix):].strip()
-            break
+    # Generate response
+    response = {
+        "caption": final_caption,
+        "tone": tone,
+        "confidence": confidence,
+        "model": model_used,
+        "frames": len(frames),
+        "processing_time": processing_time,
+        "timestamp": datetime.utcnow().isoformat(),
+        "image_id": str(uuid.uuid4())
+    }
     
-    # Ensure caption starts with lowercase for integration
-    if caption and caption[0].isupper() and len(caption) > 1:
-        caption = caption[0].lower() + caption[1:]
+    return response
+
+# Caption an image by URL (object storage / CDN)
+@app.post("/api/v1/caption/url")
+async def generate_caption_from_url(request: CaptionUrlRequest):
+    """Fetch a remote image and caption it like an upload"""
     
-    # Apply tone-specific formatting
-    if tone == "formal":
-        # Professional and descriptive
-        return f"The image depicts {caption}, presenting a detailed view of the subject matter."
+    start_time = time.time()
+    tone = request.tone.value
+    quality = request.quality.value
+    logger.info(f"🌐 Received URL request - {request.url}, Tone: {tone}, Quality: {quality}")
     
-    elif tone == "casual":
-        # Friendly and conversational
-        if not caption.endswith(("!", ".", "?")):
-            caption += "!"
-        return f"Check out this {caption}"
+    try:
+        contents = await image_fetcher.fetch(request.url)
+    except ImageFetchError as e:
+        raise HTTPException(e.status_code, e.message)
     
-    elif tone == "humorous":
-        # Witty and entertaining
-        funny_intros = [
-            f"Plot twist: it's {caption} 😄",
-            f"Surprise! We've got {caption} here! 🎉",
-            f"Breaking: Local image contains {caption}! 📰",
-            f"Nobody expects {caption}! 😂"
-        ]
-        import random
-        return random.choice(funny_intros)
+    # Decoding and inference are blocking; keep them off the event loop
+    frames = await run_in_threadpool(decode_frames, contents)
+    try:
+        response = await run_in_threadpool(caption_response, frames, tone, quality, start_time)
+        response["url"] = request.url
+        return response
+    except Exception as e:
+        logger.error(f"Unexpected error: {str(e)}")
+        raise HTTPException(500, f"Internal server error: {str(e)}")
+
+# Caption several images by URL
+@app.post("/api/v1/caption/url/batch")
+async def generate_captions_from_urls(request: BatchCaptionUrlRequest):
+    """
+    Fetch remote images concurrently and caption them.
+    Still images share one batched inference call; failures are reported per URL.
+    """
     
-    elif tone == "poetic":
-        # Lyrical and evocative
-        return f"In this captured moment, {caption} emerges like a whispered dream, painting stories in light and shadow..."
+    start_time = time.time()
+    tone = request.tone.value
+    quality = request.quality.value
+    logger.info(f"🌐 Received batch URL request - {len(request.urls)} URLs, Tone: {tone}")
     
-    elif tone == "technical":
-        # Precise and analytical
-        return f"Technical Analysis: The image composition features {caption}. Observable elements include structured arrangement and balanced visual hierarchy."
+    fetched = await image_fetcher.fetch_many(request.urls)
     
-    elif tone == "marketing":
-        # Engaging and persuasive
-        return f"✨ Discover the beauty of {caption} - Capturing moments that inspire and elevate your vision! #Trending"
+    # Decoding and inference are blocking; keep them off the event loop
+    captions = await run_in_threadpool(caption_fetched, request.urls, fetched, tone, quality, start_time)
     
-    elif tone == "storytelling":
-        # Narrative and engaging
-        return f"Once upon a time, in a world frozen in pixels, there was {caption}. And what a tale it tells..."
+    processing_time = time.time() - start_time
+    logger.info(f"✅ Batch completed in {processing_time:.2f}s")
+    return {"captions": captions, "processing_time": processing_time}
+
+def caption_fetched(urls, fetched, tone: str, quality: str, start_time: float):
+    """Decode and caption fetched images; failed fetches are reported per URL"""
+    items = []
+    for url, contents in zip(urls, fetched):
+        if isinstance(contents, ImageFetchError):
+            items.append({"url": url, "error": contents.message, "status_code": contents.status_code})
+            continue
+        try:
+            items.append({"url": url, "frames": load_keyframes(contents)})
+        except Exception as e:
+            items.append({"url": url, "error": f"Invalid image file: {str(e)}", "status_code": 400})
     
-    else:
-        # Default - return with slight enhancement
-        return f"This image shows {caption}."
+    # Run every still image through the engine together
+    stills = [item for item in items if len(item.get("frames", [])) == 1]
+    precomputed = {}
+    if model_manager.loaded and stills:
+        try:
+            results = model_manager.caption([item["frames"][0] for item in stills], tones=tone, quality=quality)
+            precomputed = {id(item): {**result, "frames": 1} for item, result in zip(stills, results)}
+        except Exception as e:
+            logger.error(f"Batched inference failed: {e}")
+    
+    captions = []
+    for item in items:
+        if "error" in item:
+            captions.append({"url": item["url"], "error": item["error"], "status_code": item["status_code"]})
+            continue
+        response = caption_response(item["frames"], tone, quality, start_time, precomputed.get(id(item)))
+        response["url"] = item["url"]
+        captions.append(response)
+    return captions
 
 # Get available tones
 @app.get("/api/v1/tones")
@@ -343,7 +299,14 @@ async def model_status():
     return {
         "loaded": model_manager.loaded,
         "device": str(model_manager.device) if model_manager.device else None,
-        "model_name": "Salesforce/blip-image-captioning-base" if model_manager.loaded else None
+        "model_name": settings.base_model_name if "base" in model_manager.models else (settings.large_model_name if model_manager.loaded else None),
+        "mode": model_manager.mode,
+        "cascade_threshold": model_manager.threshold,
+        "models": sorted(model_manager.models.keys()),
+        "cascade": model_manager.engine_stats(),
+        "url_fetcher": image_fetcher.fetcher_stats(),
+        "batch_size": model_manager.batch_size,
+        "tuning": model_manager.tuning
     }
 
 # Optional: Endpoint to reload model
@@ -12,6 +12,11 @@ class ToneEnum(str, Enum):
     marketing = "marketing"
     storytelling = "storytelling"
 
+class QualityEnum(str, Enum):
+    fast = "fast"        # base model only
+    auto = "auto"        # escalate to the large model on low confidence
+    quality = "quality"  # large model only
+
 class CaptionRequest(BaseModel):
     tone: ToneEnum = Field(default=ToneEnum.casual)
     additional_context: Optional[str] = None
@@ -29,6 +34,16 @@ class BatchCaptionRequest(BaseModel):
     images: List[str]  # Base64 encoded images
     tone: ToneEnum = Field(default=ToneEnum.casual)
 
+class CaptionUrlRequest(BaseModel):
+    url: str
+    tone: ToneEnum = Field(default=ToneEnum.casual)
+    quality: QualityEnum = Field(default=QualityEnum.auto)
+
+class BatchCaptionUrlRequest(BaseModel):
+    urls: List[str] = Field(min_length=1, max_length=32)
+    tone: ToneEnum = Field(default=ToneEnum.casual)
+    quality: QualityEnum = Field(default=QualityEnum.auto)
+
 class SocialMediaIntegration(BaseModel):
     platform: str
     caption: str
@@ -0,0 +1,81 @@
+"""
+Benchmark average caption latency for base-only, large-only and cascade modes
+on a fixed local image set.
+
+Usage (from the backend/ directory):
+    python benchmarks/benchmark_cascade.py path/to/images --threshold 0.5
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.engine import CaptionEngine, prepare_image  # noqa: E402
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
+
+
+def load_images(directory):
+    """Load every image in the directory as RGB, in a stable order"""
+    images = []
+    for name in sorted(os.listdir(directory)):
+        if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS:
+            images.append(prepare_image(Image.open(os.path.join(directory, name))))
+    return images
+
+
+def run(engine, images, quality, rounds):
+    """Return per-image latencies (seconds) for the given quality setting"""
+    latencies = []
+    for _ in range(rounds):
+        for image in images:
+            start = time.perf_counter()
+            engine.caption(image, tones=[], quality=quality)
+            latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("images", help="Directory containing the benchmark images")
+    parser.add_argument("--threshold", type=float, default=0.5, help="Cascade confidence threshold")
+    parser.add_argument("--rounds", type=int, default=3, help="Passes over the image set per mode")
+    args = parser.parse_args()
+
+    images = load_images(args.images)
+    if not images:
+        sys.exit(f"No images found in {args.images}")
+
+    # No cache, so every round measures real inference
+    engine = CaptionEngine(mode="cascade", threshold=args.threshold, use_cache=False)
+    if not engine.load():
+        sys.exit("Failed to load models")
+
+    # Warm up both models so the first timed request is not penalised
+    engine.caption(images[0], tones=[], quality="fast")
+    engine.caption(images[0], tones=[], quality="quality")
+
+    results = {}
+    for label, quality in (("base-only", "fast"), ("large-only", "quality"), ("cascade", "auto")):
+        before = dict(engine.stats)
+        latencies = run(engine, images, quality, args.rounds)
+        escalated = engine.stats["escalated_low_confidence"] - before["escalated_low_confidence"]
+        results[label] = (latencies, escalated)
+
+    print(f"\n{len(images)} images x {args.rounds} rounds, threshold={args.threshold}")
+    print(f"{'mode':<12}{'mean (s)':>10}{'p50 (s)':>10}{'max (s)':>10}{'escalated':>12}")
+    for label, (latencies, escalated) in results.items():
+        rate = f"{escalated / len(latencies):.0%}" if label == "cascade" else "-"
+        print(
+            f"{label:<12}{statistics.mean(latencies):>10.3f}"
+            f"{statistics.median(latencies):>10.3f}{max(latencies):>10.3f}{rate:>12}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+import json
+
+import pytest
+import torch
+
+from app import autotune
+from app.engine import CaptionEngine
+
+
+@pytest.fixture
+def engine(monkeypatch, tmp_path):
+    """Loaded-looking CPU engine whose benchmark and warm-up are stubbed"""
+    original_threads = torch.get_num_threads()
+    engine = CaptionEngine(mode="base", use_cache=False)
+    engine.loaded = True
+    engine.device = torch.device("cpu")
+    engine.models = {"base": None}
+
+    monkeypatch.setattr(autotune, "usable_cores", lambda: 4)
+    monkeypatch.setattr(autotune, "warm_up", lambda engine: {"base": 0.0})
+    monkeypatch.setattr(autotune.settings, "autotune_path", str(tmp_path / "autotune.json"))
+    monkeypatch.setattr(autotune.settings, "autotune_batch_sizes", [1, 2, 4, 8])
+    monkeypatch.setattr(autotune.settings, "autotune_time_budget", 60.0)
+    yield engine
+    torch.set_num_threads(original_threads)
+
+
+def _stub_benchmark(monkeypatch, seconds):
+    """seconds(threads, batch_size) -> seconds per batch; records measured points"""
+    measured = []
+
+    def benchmark(engine, key, batch_size, repeats):
+        threads = torch.get_num_threads()
+        measured.append((threads, batch_size))
+        return seconds(threads, batch_size)
+
+    monkeypatch.setattr(autotune, "_benchmark", benchmark)
+    return measured
+
+
+def test_picks_lowest_latency_threads_then_best_throughput_batch(engine, monkeypatch):
+    # 2 threads is fastest for a single image; batches amortise well
+    measured = _stub_benchmark(monkeypatch, lambda t, b: (1.0 if t == 2 else 2.0) * (0.5 + 0.5 * b))
+
+    tuning = autotune.autotune(engine, persist=False)
+
+    assert tuning["threads"] == 2
+    assert tuning["batch_size"] == 8
+    assert engine.batch_size == 8
+    assert measured == [(4, 1), (2, 1), (1, 1), (2, 2), (2, 4), (2, 8)]
+    assert tuning["budget_exhausted"] is False
+
+
+def test_skips_batches_larger_than_four_times_threads(engine, monkeypatch):
+    monkeypatch.setattr(autotune, "usable_cores", lambda: 1)
+    measured = _stub_benchmark(monkeypatch, lambda t, b: 1.0)
+
+    autotune.autotune(engine, persist=False)
+
+    assert (1, 8) not in measured
+    assert measured == [(1, 1), (1, 2), (1, 4)]
+
+
+def test_budget_cuts_off_sweep(engine, monkeypatch):
+    monkeypatch.setattr(autotune.settings, "autotune_time_budget", 0.0)
+    measured = _stub_benchmark(monkeypatch, lambda t, b: 1.0)
+
+    tuning = autotune.autotune(engine, persist=False)
+
+    assert measured == [(4, 1)]
+    assert tuning["budget_exhausted"] is True
+    assert tuning["threads"] == 4 and tuning["batch_size"] == 1
+
+
+def test_persisted_result_is_reused(engine, monkeypatch):
+    measured = _stub_benchmark(monkeypatch, lambda t, b: 1.0)
+    first = autotune.autotune(engine, persist=True)
+
+    engine.batch_size = 99
+    second = autotune.autotune(engine, persist=True)
+
+    assert first["source"] == "measured"
+    assert second["source"] == "persisted"
+    assert engine.batch_size == first["batch_size"]
+    assert len(measured) == len(first["curve"])  # nothing re-measured
+
+
+def test_host_signature_mismatch_retunes(engine, monkeypatch):
+    measured = _stub_benchmark(monkeypatch, lambda t, b: 1.0)
+    autotune.autotune(engine, persist=True)
+    count = len(measured)
+
+    monkeypatch.setattr(autotune, "usable_cores", lambda: 2)
+    tuning = autotune.autotune(engine, persist=True)
+
+    assert tuning["source"] == "measured"
+    assert len(measured) > count
+
+
+@pytest.mark.parametrize("content", [
+    [],
+    {"host": None},
+    "HOST_WITHOUT_THREADS",
+    "HOST_WITH_BAD_BATCH",
+])
+def test_malformed_persisted_file_retunes(engine, monkeypatch, content):
+    host = autotune.host_signature(engine)
+    if content == "HOST_WITHOUT_THREADS":
+        content = {"host": host, "batch_size": 2}
+    elif content == "HOST_WITH_BAD_BATCH":
+        content = {"host": host, "threads": 2, "batch_size": "eight"}
+    with open(autotune.settings.autotune_path, "w") as f:
+        json.dump(content, f)
+    _stub_benchmark(monkeypatch, lambda t, b: 1.0)
+
+    assert autotune.autotune(engine, persist=True)["source"] == "measured"
+
+
+def test_startup_applies_persisted_result_even_when_sweep_disabled(engine, monkeypatch):
+    _stub_benchmark(monkeypatch, lambda t, b: 1.0 if b == 4 else 2.0)
+    autotune.autotune(engine, persist=True)
+
+    monkeypatch.setattr(autotune.settings, "autotune_on_startup", False)
+    monkeypatch.setattr(autotune.settings, "autotune_persist", True)
+    engine.batch_size = 1
+
+    assert autotune.startup_tune(engine)["source"] == "persisted"
+    assert engine.batch_size == 4
@@ -0,0 +1,124 @@
+import pytest
+from PIL import Image
+
+from app.engine import CaptionEngine
+
+
+class StubEngine(CaptionEngine):
+    """CaptionEngine with both models 'resident' and _generate_batch faked"""
+
+    def __init__(self, base_confidence, threshold=0.5):
+        super().__init__(mode="cascade", threshold=threshold, use_cache=False)
+        self.loaded = True
+        self.models = {"base": None, "large": None}
+        # image index (stored in the red channel) -> base confidence
+        self.base_confidence = base_confidence
+        self.calls = []
+
+    def _generate_batch(self, images, key, context=None):
+        indices = [image.getpixel((0, 0))[0] for image in images]
+        self.calls.append((key, indices))
+        return [
+            {
+                "caption": f"{key} caption {i}",
+                "confidence": self.base_confidence[i] if key == "base" else 0.9,
+                "model": key,
+                "escalated": False
+            }
+            for i in indices
+        ]
+
+
+def _images(count):
+    return [Image.new("RGB", (4, 4), (i, 0, 0)) for i in range(count)]
+
+
+def test_auto_escalates_low_confidence_images_in_one_large_batch():
+    engine = StubEngine({0: 0.9, 1: 0.2, 2: 0.8, 3: 0.1})
+    results = engine.caption(_images(4), tones=[], quality="auto")
+
+    assert engine.calls == [("base", [0, 1, 2, 3]), ("large", [1, 3])]
+    assert [result["model"] for result in results] == ["base", "large", "base", "large"]
+    assert [result["escalated"] for result in results] == [False, True, False, True]
+    assert engine.stats["escalated"] == engine.stats["escalated_low_confidence"] == 2
+    assert engine.engine_stats()["escalation_rate"] == 0.5
+
+
+def test_fast_never_escalates():
+    engine = StubEngine({0: 0.1, 1: 0.1})
+    results = engine.caption(_images(2), tones=[], quality="fast")
+
+    assert engine.calls == [("base", [0, 1])]
+    assert all(result["model"] == "base" and not result["escalated"] for result in results)
+    assert engine.stats["escalated"] == 0
+
+
+def test_quality_always_uses_large_model():
+    engine = StubEngine({0: 0.99, 1: 0.99})
+    results = engine.caption(_images(2), tones=[], quality="quality")
+
+    assert engine.calls == [("large", [0, 1])]
+    assert all(result["model"] == "large" and result["escalated"] for result in results)
+    assert engine.stats["escalated_quality_requested"] == 2
+    assert engine.stats["escalated_low_confidence"] == 0
+    assert engine.engine_stats()["escalation_rate"] == 1.0
+
+
+def test_caption_frames_merges_model_and_escalated_flags():
+    engine = StubEngine({0: 0.9, 1: 0.2})
+    result = engine.caption_frames(_images(2), tones="casual")
+
+    assert result["frames"] == 2
+    assert result["model"] == "large"
+    assert result["escalated"] is True
+    assert result["caption"] == "base caption 0, then large caption 1"
+    assert result["confidence"] == pytest.approx(0.9)
+    assert set(result["captions"]) == {"casual"}
+
+
+def test_cache_key_changes_with_threshold_and_models(monkeypatch):
+    engine = StubEngine({}, threshold=0.5)
+    key = engine._cache_key("hash", "auto", None)
+
+    assert engine._cache_key("hash", "fast", None) != key
+    engine.threshold = 0.6
+    assert engine._cache_key("hash", "auto", None) != key
+
+    engine.threshold = 0.5
+    monkeypatch.setattr("app.engine.settings.large_model_name", "other/large")
+    assert engine._cache_key("hash", "auto", None) != key
+
+
+def test_caption_frames_uses_one_batch_regardless_of_tuned_batch_size():
+    engine = StubEngine({0: 0.9, 1: 0.2, 2: 0.1})
+    engine.batch_size = 1
+    engine.caption_frames(_images(3), tones="casual")
+
+    assert engine.calls == [("base", [0, 1, 2]), ("large", [1, 2])]
+
+
+def test_concurrent_captions_are_serialized():
+    import threading
+    import time
+
+    engine = StubEngine({0: 0.9})
+    active = []
+    overlaps = []
+    generate = engine._generate_batch
+
+    def slow_generate(images, key, context=None):
+        active.append(1)
+        overlaps.append(len(active))
+        time.sleep(0.02)
+        active.pop()
+        return generate(images, key, context)
+
+    engine._generate_batch = slow_generate
+    threads = [threading.Thread(target=engine.caption, args=(_images(1),), kwargs={"tones": []}) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert max(overlaps) == 1
+    assert engine.stats["requests"] == 4
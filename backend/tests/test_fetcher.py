@@ -0,0 +1,182 @@
+import asyncio
+import io
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image
+
+from app import main_full
+from app.fetcher import GuardedNetworkBackend, ImageFetcher, ImageFetchError
+
+
+def _png_bytes():
+    buffer = io.BytesIO()
+    Image.new("RGB", (16, 16), (200, 30, 30)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+PNG = _png_bytes()
+ETAG = '"v1"'
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Minimal object-storage stand-in; HTTP/1.0 so bodies may omit Content-Length"""
+
+    requests = []
+    hosts = []
+
+    def do_GET(self):
+        StandInHandler.requests.append((self.path, self.headers.get("If-None-Match")))
+        StandInHandler.hosts.append(self.headers.get("Host"))
+        if self.path == "/image.png":
+            if self.headers.get("If-None-Match") == ETAG:
+                self.send_response(304)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "image/png")
+            self.send_header("Content-Length", str(len(PNG)))
+            self.send_header("ETag", ETAG)
+            self.end_headers()
+            self.wfile.write(PNG)
+        elif self.path == "/big":
+            # No Content-Length: the limit must be enforced while streaming
+            self.send_response(200)
+            self.end_headers()
+            self.wfile.write(b"x" * 4096)
+        elif self.path == "/redirect-out":
+            self.send_response(302)
+            self.send_header("Location", "http://metadata.internal/latest")
+            self.end_headers()
+        else:
+            self.send_response(404)
+            self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture(scope="module")
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+
+
+def _local_fetcher(**kwargs):
+    return ImageFetcher(allow_private_networks=True, **kwargs)
+
+
+def _fetch(fetcher, url):
+    async def run():
+        try:
+            return await fetcher.fetch(url)
+        finally:
+            await fetcher.close()
+    return asyncio.run(run())
+
+
+def test_etag_revalidation_serves_304_from_cache(server):
+    fetcher = _local_fetcher()
+
+    async def run():
+        try:
+            first = await fetcher.fetch(f"{server}/image.png")
+            second = await fetcher.fetch(f"{server}/image.png")
+            return first, second
+        finally:
+            await fetcher.close()
+
+    first, second = asyncio.run(run())
+    assert first == second == PNG
+    assert fetcher.stats["fetched"] == 1
+    assert fetcher.stats["not_modified"] == 1
+    assert StandInHandler.requests[-1] == ("/image.png", ETAG)
+
+
+def test_body_over_limit_without_content_length_is_413(server):
+    with pytest.raises(ImageFetchError) as error:
+        _fetch(_local_fetcher(max_bytes=1024), f"{server}/big")
+    assert error.value.status_code == 413
+
+
+def test_non_200_is_400_without_upstream_status(server):
+    with pytest.raises(ImageFetchError) as error:
+        _fetch(_local_fetcher(), f"{server}/missing")
+    assert error.value.status_code == 400
+    assert "404" not in error.value.message
+
+
+@pytest.mark.parametrize("url", ["http://[::1/x", "http://a\x00b/", "ftp://example.com/a.png", "not a url"])
+def test_malformed_urls_are_400(url):
+    with pytest.raises(ImageFetchError) as error:
+        _fetch(ImageFetcher(), url)
+    assert error.value.status_code == 400
+
+
+def test_private_addresses_are_rejected_by_default(server):
+    with pytest.raises(ImageFetchError) as error:
+        _fetch(ImageFetcher(), f"{server}/image.png")
+    assert error.value.status_code == 400
+
+
+def test_redirects_are_rechecked_against_allowed_hosts(server):
+    with pytest.raises(ImageFetchError) as error:
+        _fetch(_local_fetcher(allowed_hosts=["127.0.0.1"]), f"{server}/redirect-out")
+    assert error.value.status_code == 400
+    assert "metadata.internal" in error.value.message
+
+
+class FlippingResolver:
+    """Resolver whose answer changes after the first lookup (DNS rebinding)"""
+
+    def __init__(self, *answers):
+        self.answers = list(answers)
+        self.calls = 0
+
+    async def __call__(self, host, port):
+        answer = self.answers[min(self.calls, len(self.answers) - 1)]
+        self.calls += 1
+        return [answer]
+
+
+def test_connection_goes_to_the_validated_address(server):
+    # Only 127.0.0.1 passes the check; later answers point elsewhere
+    resolver = FlippingResolver("127.0.0.1", "10.255.255.1")
+    fetcher = ImageFetcher(resolver=resolver)
+    fetcher.network_backend = GuardedNetworkBackend(resolver, address_allowed=lambda address: address == "127.0.0.1")
+    port = server.rsplit(":", 1)[1]
+
+    assert _fetch(fetcher, f"http://images.test:{port}/image.png") == PNG
+    assert resolver.calls == 1
+    # The original hostname is still sent even though the IP was dialed
+    assert StandInHandler.hosts[-1] == f"images.test:{port}"
+
+
+def test_rebinding_to_private_address_is_rejected_at_connect(server):
+    resolver = FlippingResolver("169.254.169.254", "127.0.0.1")
+    port = server.rsplit(":", 1)[1]
+    seen = len(StandInHandler.requests)
+
+    with pytest.raises(ImageFetchError) as error:
+        _fetch(ImageFetcher(resolver=resolver), f"http://images.test:{port}/image.png")
+    assert error.value.status_code == 400
+    assert len(StandInHandler.requests) == seen
+
+
+def test_batch_reports_failures_per_url(server, monkeypatch):
+    monkeypatch.setattr(main_full, "image_fetcher", _local_fetcher(max_bytes=1024))
+    urls = [f"{server}/image.png", f"{server}/missing", f"{server}/big", "http://[::1/x"]
+
+    # Not used as a context manager, so startup (model loading) does not run
+    response = TestClient(main_full.app).post("/api/v1/caption/url/batch", json={"urls": urls})
+
+    assert response.status_code == 200
+    captions = response.json()["captions"]
+    assert [item["url"] for item in captions] == urls
+    assert "caption" in captions[0]
+    assert [item.get("status_code") for item in captions[1:]] == [400, 413, 400]
@@ -0,0 +1,74 @@
+import io
+
+import pytest
+from PIL import Image
+
+from app.engine import load_keyframes, merge_frame_captions, sample_keyframes
+
+
+def _animation(colors, fmt="GIF", size=(64, 64)):
+    """Encode one solid-colour frame per entry as an animated image"""
+    frames = [Image.new("RGB", size, color) for color in colors]
+    buffer = io.BytesIO()
+    frames[0].save(buffer, format=fmt, save_all=True, append_images=frames[1:], duration=50, loop=0)
+    return buffer.getvalue()
+
+
+def _distinct_colors(count):
+    # Alternate bright/dark steps so consecutive frames always differ clearly
+    return [((i * 97) % 256, (i * 53 + 128) % 256, (255 - i * 31) % 256) for i in range(count)]
+
+
+@pytest.mark.parametrize("fmt", ["GIF", "WEBP"])
+def test_short_animation_keeps_every_distinct_frame(fmt):
+    frames = load_keyframes(_animation([(255, 0, 0), (0, 0, 255), (0, 255, 0)], fmt))
+    assert len(frames) == 3
+    assert all(frame.mode == "RGB" for frame in frames)
+
+
+@pytest.mark.parametrize("fmt", ["GIF", "WEBP"])
+def test_long_animation_is_capped_at_max_keyframes(fmt):
+    image = Image.open(io.BytesIO(_animation(_distinct_colors(60), fmt)))
+    frames = sample_keyframes(image, max_keyframes=4, diff_threshold=1.0)
+    assert len(frames) == 4
+
+
+def test_long_animation_respects_max_frames():
+    image = Image.open(io.BytesIO(_animation(_distinct_colors(40))))
+    frames = sample_keyframes(image, max_keyframes=50, diff_threshold=1.0, max_frames=10)
+    assert len(frames) == 10
+
+
+def test_halving_keeps_keyframes_spread_in_temporal_order():
+    # 40 scanned frames with max_keyframes=3 halves the kept list (and doubles
+    # the stride) several times before the final even selection
+    colors = _distinct_colors(40)
+    image = Image.open(io.BytesIO(_animation(colors)))
+    frames = sample_keyframes(image, max_keyframes=3, diff_threshold=1.0)
+
+    assert len(frames) == 3
+    first = frames[0].getpixel((0, 0))
+    assert all(abs(a - b) <= 8 for a, b in zip(first, colors[0]))
+    assert len({frame.getpixel((0, 0)) for frame in frames}) == 3
+
+
+def test_near_identical_frames_are_deduplicated():
+    colors = [(100, 100, 100), (101, 100, 100), (100, 101, 100), (100, 100, 101)]
+    frames = load_keyframes(_animation(colors))
+    assert len(frames) == 1
+
+
+def test_still_image_with_alpha_is_flattened_on_white():
+    image = Image.new("RGBA", (32, 32), (0, 0, 0, 0))
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+
+    frames = load_keyframes(buffer.getvalue())
+    assert len(frames) == 1
+    assert frames[0].mode == "RGB"
+    assert frames[0].getpixel((0, 0)) == (255, 255, 255)
+
+
+def test_merge_collapses_only_consecutive_repeats():
+    assert merge_frame_captions(["a cat", "a cat", "a dog", "a cat"]) == "a cat, then a dog, then a cat"
+    assert merge_frame_captions(["a cat", "", "a cat"]) == "a cat"